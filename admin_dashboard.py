@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 from supabase import create_client, Client
 from datetime import datetime, timedelta
@@ -61,7 +62,9 @@ date_range = st.sidebar.date_input(
 )
 
 # --- LOAD DATA (Timezone Logic) ---
-@st.cache_data(ttl=60)
+# Cached as a shared resource so reruns get the frame back without a pickle round trip.
+# Callers must treat the returned frame as read-only.
+@st.cache_resource(ttl=60)
 def load_data(start_date, end_date, timezone_str):
     # 1. Define the Target Timezone
     tz = pytz.timezone(timezone_str)
@@ -76,8 +79,8 @@ def load_data(start_date, end_date, timezone_str):
     end_utc_str = end_dt_loc.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
     
     try:
-        # Query DB using UTC (Supabase standard)
-        response = supabase.table("logs").select("*")\
+        # Query DB using UTC (Supabase standard), fetching only the columns the report uses
+        response = supabase.table("logs").select("created_at,user_name,status,application", count=None)\
             .gte("created_at", start_utc_str)\
             .lte("created_at", end_utc_str)\
             .order("created_at", desc=False)\
@@ -92,19 +95,15 @@ def load_data(start_date, end_date, timezone_str):
     df = pd.DataFrame(response.data)
     
     # 4. Convert UTC Database logs -> Target Timezone for Display
-    df['created_at'] = pd.to_datetime(df['created_at'])
-    
-    # Ensure UTC awareness
-    if df['created_at'].dt.tz is None:
-        df['created_at'] = df['created_at'].dt.tz_localize('UTC')
-    else:
-        df['created_at'] = df['created_at'].dt.tz_convert('UTC')
+    # utc=True parses naive and offset timestamps as UTC in one pass
+    df['created_at'] = pd.to_datetime(df['created_at'], utc=True, format='ISO8601', cache=True)
     
     # Convert to the Admin's selected timezone
     df['created_at'] = df['created_at'].dt.tz_convert(timezone_str)
     
-    # Format Date column
-    df['Date'] = df['created_at'].dt.strftime('%m-%d-%Y')
+    # Low-cardinality text columns: store as category codes for cheap masks and groupbys
+    for col in ('user_name', 'status', 'application'):
+        df[col] = df[col].astype('category')
     return df
 
 # Apply Load
@@ -120,7 +119,7 @@ if df.empty:
     st.stop()
 
 # --- USER FILTER ---
-all_users = df['user_name'].unique()
+all_users = df['user_name'].unique().tolist()
 selected_users = st.sidebar.multiselect("Select Employees", all_users, default=all_users)
 df = df[df['user_name'].isin(selected_users)]
 
@@ -129,78 +128,77 @@ if df.empty:
     st.stop()
 
 # --- LOGIC 1: CONDENSE SESSIONS ---
+@st.cache_data(ttl=60, show_spinner=False)
 def condense_sessions(raw_df):
     if raw_df.empty: return pd.DataFrame()
 
-    df_clean = raw_df.copy()
-    df_clean['minute_bucket'] = df_clean['created_at'].dt.floor('min')
-
-    minute_groups = df_clean.groupby(['user_name', 'minute_bucket'])
-    
-    minutes_data = []
-    for (user, minute), group in minute_groups:
-        try:
-            if not group.empty:
-                dominant_app = group['application'].mode()[0]
-                dominant_status = group['status'].mode()[0]
-                minutes_data.append({
-                    'User': user,
-                    'Start': minute,
-                    'End': minute + timedelta(minutes=1),
-                    'App': dominant_app,
-                    'Status': dominant_status,
-                    'Duration_Mins': 1.0
-                })
-        except IndexError:
-            continue
-            
-    if not minutes_data: return pd.DataFrame()
-    return pd.DataFrame(minutes_data)
+    # Group on a standalone bucket series instead of copying raw_df to add a column
+    minute_bucket = raw_df['created_at'].dt.floor('min').rename('minute_bucket')
+
+    keys = ['user_name', 'minute_bucket']
+
+    # Single pass over the logs: row counts per (user, minute, app, status)
+    group_keys = [raw_df['user_name'], minute_bucket, raw_df['application'], raw_df['status']]
+    counts = raw_df.groupby(group_keys, sort=False, observed=True, dropna=False).size()
+
+    # Most frequent value per (user, minute); ties go to the lowest value, like mode()[0]
+    def dominant(col):
+        totals = counts.groupby(level=keys + [col], sort=False, observed=True).sum().reset_index(name='n')
+        totals = totals.sort_values(by=['n', col], ascending=[False, True])
+        return totals.drop_duplicates(subset=keys)[keys + [col]]
+
+    minutes_df = dominant('application').merge(dominant('status'), on=keys)
+    if minutes_df.empty: return pd.DataFrame()
+
+    # Build the output column-wise in one go
+    start = minutes_df['minute_bucket']
+    return pd.DataFrame({
+        'User': minutes_df['user_name'],
+        'Start': start,
+        'End': start + timedelta(minutes=1),
+        'App': minutes_df['application'],
+        'Status': minutes_df['status'],
+        'Duration_Mins': 1.0
+    })
 
 # --- LOGIC 2: SMART AGGREGATION ---
+@st.cache_data(ttl=60, show_spinner=False)
 def process_productivity(session_df):
     if session_df.empty: return pd.DataFrame(), pd.DataFrame()
     
     df = session_df.sort_values(by=['User', 'Start'])
-    
-    sessions = []
-    current_session = None
 
-    for _, row in df.iterrows():
-        if current_session is None:
-            current_session = row.to_dict()
-            continue
-            
-        time_gap = (row['Start'] - current_session['End']).total_seconds()
-        
-        if (row['User'] == current_session['User'] and 
-            row['App'] == current_session['App'] and 
-            row['Status'] == current_session['Status'] and
-            time_gap <= 60): 
-            
-            current_session['End'] = row['End']
-            current_session['Duration_Mins'] += row['Duration_Mins']
-        else:
-            sessions.append(current_session)
-            current_session = row.to_dict()
-            
-    if current_session:
-        sessions.append(current_session)
-        
-    merged_df = pd.DataFrame(sessions)
+    # A new session starts whenever User/App/Status changes or there is a gap > 60s
+    time_gap = (df['Start'] - df['End'].shift()).dt.total_seconds()
+    new_session = ((df['User'] != df['User'].shift()) |
+                   (df['App'] != df['App'].shift()) |
+                   (df['Status'] != df['Status'].shift()) |
+                   (time_gap > 60))
+    session_id = new_session.cumsum()
+
+    merged_df = df.groupby(session_id, sort=False).agg(
+        User=('User', 'first'),
+        Start=('Start', 'min'),
+        End=('End', 'max'),
+        App=('App', 'first'),
+        Status=('Status', 'first'),
+        Duration_Mins=('Duration_Mins', 'sum')
+    ).reset_index(drop=True)
     
     # Idle Filtering
-    valid_df = merged_df[~((merged_df['Status'] == 'Idle') & (merged_df['Duration_Mins'] > MAX_IDLE_THRESHOLD_MINS))].copy()
+    valid_df = merged_df[~(merged_df['Status'].eq('Idle') & (merged_df['Duration_Mins'] > MAX_IDLE_THRESHOLD_MINS))].copy()
     
     # Hourly Aggregation
-    valid_df['Hour'] = valid_df['Start'].dt.strftime('%I %p') # 12-hour format (e.g. 02 PM)
-    valid_df['Date'] = valid_df['Start'].dt.strftime('%m-%d-%Y')
+    # Sortable Date/Hour values; labels are only formatted for display
+    valid_df['Hour'] = valid_df['Start'].dt.hour.astype('int8')
+    valid_df['Date'] = valid_df['Start'].dt.normalize()
     
-    valid_df['Active_Mins'] = valid_df.apply(lambda x: x['Duration_Mins'] if x['Status'] == 'Active' else 0, axis=1)
-    valid_df['Idle_Mins'] = valid_df.apply(lambda x: x['Duration_Mins'] if x['Status'] == 'Idle' else 0, axis=1)
+    duration = valid_df['Duration_Mins'].to_numpy()
+    valid_df['Active_Mins'] = np.where(valid_df['Status'].eq('Active').to_numpy(), duration, 0.0)
+    valid_df['Idle_Mins'] = np.where(valid_df['Status'].eq('Idle').to_numpy(), duration, 0.0)
     
-    grouped_hourly = valid_df.groupby(['User', 'Date', 'Hour', 'App'])[['Active_Mins', 'Idle_Mins']].sum().reset_index()
-    # Sort by Date then Time (custom sort might be needed for perfect 12h sort, but this groups them well)
+    grouped_hourly = valid_df.groupby(['User', 'Date', 'Hour', 'App'], observed=True)[['Active_Mins', 'Idle_Mins']].sum().reset_index()
+    # Sort by Date then Time
     grouped_hourly = grouped_hourly.sort_values(by=['User', 'Date', 'Hour'])
     
     return valid_df, grouped_hourly
@@ -215,13 +213,16 @@ st.markdown(f"**Viewing Timezone:** `{selected_timezone}` | **Idle Cutoff:** >{M
 st.markdown("---")
 
 if st.button("🔄 Refresh Data"):
+    load_data.clear()
     st.cache_data.clear()
     st.rerun()
 
 # KPI Calculation
 if not valid_sessions.empty:
-    total_active_mins = valid_sessions[valid_sessions['Status'] == 'Active']['Duration_Mins'].sum()
-    total_idle_mins = valid_sessions[valid_sessions['Status'] == 'Idle']['Duration_Mins'].sum()
+    # One groupby pass for all statuses; also feeds the Activity Split pie
+    status_totals = valid_sessions.groupby('Status', observed=True)['Duration_Mins'].sum()
+    total_active_mins = status_totals.get('Active', 0.0)
+    total_idle_mins = status_totals.get('Idle', 0.0)
     total_hours = round((total_active_mins + total_idle_mins) / 60, 1)
     prod_score = round((total_active_mins / (total_active_mins + total_idle_mins) * 100), 1) if total_hours > 0 else 0
 else:
@@ -242,15 +243,15 @@ col_left, col_right = st.columns([1, 1])
 with col_left:
     st.subheader("🏆 Top Apps (Active Time)")
     if not valid_sessions.empty:
-        active_sessions = valid_sessions[valid_sessions['Status'] == 'Active']
+        active_sessions = valid_sessions[valid_sessions['Status'].eq('Active').to_numpy()]
         if not active_sessions.empty:
-            app_summary = active_sessions.groupby('App')['Duration_Mins'].sum().reset_index()
-            app_summary = app_summary.sort_values(by='Duration_Mins', ascending=False).head(10)
+            app_summary = active_sessions.groupby('App', sort=False, observed=True)['Duration_Mins'].sum()\
+                .nlargest(10).reset_index()
             
             fig = px.bar(app_summary, x='Duration_Mins', y='App', orientation='h', 
                          title="Minutes Spent Active", color='Duration_Mins', 
                          color_continuous_scale='Viridis')
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(fig, use_container_width=True, key='top_apps')
         else:
             st.info("No active work detected.")
     else:
@@ -259,10 +260,10 @@ with col_left:
 with col_right:
     st.subheader("⏳ Activity Split")
     if not valid_sessions.empty:
-        status_summary = valid_sessions.groupby('Status')['Duration_Mins'].sum().reset_index()
+        status_summary = status_totals.reset_index()
         fig_pie = px.pie(status_summary, values='Duration_Mins', names='Status', color='Status', 
                          color_discrete_map={'Active':'#00CC96', 'Idle':'#EF553B'})
-        st.plotly_chart(fig_pie, use_container_width=True)
+        st.plotly_chart(fig_pie, use_container_width=True, key='status_pie')
 
 st.markdown("---")
 st.subheader("📅 Hourly Breakdown")
@@ -275,6 +276,8 @@ if not hourly_df.empty:
         'Active_Mins': 'Active (mins)',
         'Idle_Mins': 'Idle (mins)'
     })
+    display_df['Date'] = display_df['Date'].dt.strftime('%m-%d-%Y')
+    display_df['Hour'] = display_df['Hour'].map(lambda h: f"{h % 12 or 12:02d} {'AM' if h < 12 else 'PM'}") # 12-hour format (e.g. 02 PM)
     
     st.dataframe(display_df, use_container_width=True, hide_index=True)
 else: